@@ -3,7 +3,6 @@
 # requires-python = ">=3.8"
 # dependencies = [
 #     "androidtvremote2>=0.0.14",
-#     "python-dotenv>=1.0.0",
 # ]
 # ///
 """
@@ -13,30 +12,141 @@ Controls Nvidia Shield playback using Android TV Remote Protocol.
 
 import argparse
 import asyncio
-import base64
+import ipaddress
 import os
-import re
+import shlex
 import socket
+import stat
+import string
 import sys
+import tempfile
 from pathlib import Path
-from dotenv import load_dotenv, set_key
-from androidtvremote2 import AndroidTVRemote
-from androidtvremote2.remote import RemoteKeyCode
+from typing import TYPE_CHECKING
+
+# androidtvremote2 pulls in cryptography and TLS machinery, so it is imported
+# where it's needed rather than at startup
+if TYPE_CHECKING:
+    from androidtvremote2 import AndroidTVRemote
 
 
 ENV_FILE = Path(__file__).parent / ".env"
 
+# Maps .env keys to the config dict returned by load_config()
+CONFIG_KEYS = {
+    "SHIELD_HOST": "host",
+}
+
+# Parsed config, keyed by the .env mtime it was read at
+_CONFIG_CACHE = {}
+
+# Fail fast when the Shield is off instead of waiting on the kernel's TCP timeout
+CONNECT_TIMEOUT = 5.0
+
+IP_HINT = "Please enter a valid IP (e.g., 192.168.1.238)"
+
+# Translation table that deletes hex digits; anything left over is invalid
+_NON_HEX = str.maketrans('', '', string.hexdigits.upper())
+
+
+def _env_mtime():
+    """Return the .env modification time, or None if it doesn't exist."""
+    try:
+        return ENV_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _split_env_line(line: str):
+    """Split an env file line into (key, raw value), or None if it isn't one."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("export "):
+        line = line[len("export "):]
+
+    key, sep, value = line.partition("=")
+    if not sep:
+        return None
+    return key.strip(), value.strip()
+
+
+def _read_env_lines(path: Path) -> list:
+    """Return the lines of an env file, or an empty list if it doesn't exist."""
+    try:
+        with open(path) as f:
+            return f.readlines()
+    except FileNotFoundError:
+        return []
+
+
+def _parse_env(path: Path) -> dict:
+    """Parse KEY=VALUE lines from an env file, ignoring blanks and comments."""
+    values = {}
+    for line in _read_env_lines(path):
+        entry = _split_env_line(line)
+        if entry is None:
+            continue
+        key, value = entry
+
+        # Values may be shell-quoted (python-dotenv wrote KEY='value')
+        try:
+            parts = shlex.split(value)
+        except ValueError:
+            parts = [value]
+        values[key] = parts[0] if parts else ""
+
+    return values
+
+
+def _write_env(path: Path, key: str, value: str):
+    """Atomically set one key in an env file, leaving other lines untouched."""
+    lines = _read_env_lines(path)
+    new_value = f"{key}={shlex.quote(value)}"
+
+    found = False
+    for i, line in enumerate(lines):
+        entry = _split_env_line(line)
+        if entry is None or entry[0] != key:
+            continue
+        prefix = "export " if line.lstrip().startswith("export ") else ""
+        lines[i] = f"{prefix}{new_value}\n"
+        found = True
+
+    if not found:
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        lines.append(f"{new_value}\n")
+
+    # Write to a sibling temp file so the replace stays on one filesystem
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.writelines(lines)
+        if path.exists():
+            os.chmod(tmp_path, stat.S_IMODE(path.stat().st_mode))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 
 def load_config():
-    """Load configuration from .env file."""
-    load_dotenv(ENV_FILE)
+    """Load configuration from .env file.
 
-    config = {
-        "host": os.getenv("SHIELD_HOST"),
-        "cert": os.getenv("SHIELD_CERT"),
-    }
+    The parsed result is cached until the file's mtime changes.
+    """
+    mtime = _env_mtime()
+    if "config" in _CONFIG_CACHE and _CONFIG_CACHE["mtime"] == mtime:
+        return dict(_CONFIG_CACHE["config"])
 
-    return config
+    env = _parse_env(ENV_FILE)
+
+    # Variables already set in the environment take precedence over the file
+    config = {name: os.environ.get(key, env.get(key)) for key, name in CONFIG_KEYS.items()}
+
+    _CONFIG_CACHE["mtime"] = mtime
+    _CONFIG_CACHE["config"] = config
+    return dict(config)
 
 
 def parse_args():
@@ -58,52 +168,55 @@ def parse_args():
 
 
 def validate_ip(ip: str) -> bool:
-    """Validate IP address format."""
-    pattern = r'^(\d{1,3}\.){3}\d{1,3}$'
-    if not re.match(pattern, ip):
-        return False
+    """Validate IP address format.
 
-    # Check each octet is 0-255
-    octets = ip.split('.')
-    return all(0 <= int(octet) <= 255 for octet in octets)
+    Leading-zero octets (e.g. 192.168.001.1) are rejected: some resolvers
+    read them as octal, so "010" could silently mean 8.
+    """
+    try:
+        ipaddress.IPv4Address(ip)
+    except ValueError:
+        return False
+    return True
 
 
 def save_config(key: str, value: str):
     """Save configuration value to .env file."""
-    # Create .env if it doesn't exist
-    if not ENV_FILE.exists():
-        ENV_FILE.touch()
+    _write_env(ENV_FILE, key, value)
 
-    set_key(ENV_FILE, key, value)
+    # Keep the cache in sync rather than forcing a re-parse on next load,
+    # honouring the same environment-over-file precedence as load_config()
+    if "config" in _CONFIG_CACHE and key in CONFIG_KEYS:
+        _CONFIG_CACHE["config"][CONFIG_KEYS[key]] = os.environ.get(key, value)
+        _CONFIG_CACHE["mtime"] = _env_mtime()
 
 
-def get_host_config(config: dict, args) -> str:
-    """Get host from args or config, prompt if missing."""
-    # Command line override
-    if args.host:
-        if not validate_ip(args.host):
-            print(f"Error: Invalid IP address format: {args.host}")
-            print("Please enter a valid IP (e.g., 192.168.1.238)")
-            sys.exit(1)
-        return args.host
-
-    # Use existing config
-    if config["host"]:
-        return config["host"]
-
-    # Prompt user
+def _prompt_host() -> str:
+    """Prompt until a valid IP is entered, then save it to .env."""
     while True:
         host = input("Enter Shield IP address: ").strip()
         if validate_ip(host):
             save_config("SHIELD_HOST", host)
             print(f"Saved IP address to {ENV_FILE}")
             return host
-        else:
-            print("Invalid IP address format. Please enter a valid IP (e.g., 192.168.1.238)")
+        print(f"Invalid IP address format. {IP_HINT}")
 
 
-async def pair_with_shield(remote: AndroidTVRemote, host: str) -> str:
-    """Pair with Shield and return certificate data.
+def get_host_config(config: dict, args) -> str:
+    """Get host from args or config, prompt if missing."""
+    # Command line override - an invalid value is an error, not a fallback
+    if args.host:
+        if validate_ip(args.host):
+            return args.host
+        print(f"Error: Invalid IP address format: {args.host}")
+        print(IP_HINT)
+        sys.exit(1)
+
+    return config["host"] or _prompt_host()
+
+
+async def pair_with_shield(remote: "AndroidTVRemote", host: str) -> bool:
+    """Pair with Shield and return whether pairing succeeded.
 
     Note: androidtvremote2 library manages certificates internally via certfile/keyfile
     parameters. The library automatically generates self-signed certificates using
@@ -119,8 +232,7 @@ async def pair_with_shield(remote: AndroidTVRemote, host: str) -> str:
     3. async_finish_pairing(pin) completes pairing with PIN
     4. Certificate files persist on disk for future connections
 
-    We store a marker in .env to indicate pairing completed, but the actual certificate
-    persistence is handled by the library itself through the certfile/keyfile paths.
+    Nothing is written to .env: the certificate files are the pairing credential.
     """
     print(f"\nInitiating pairing with Shield at {host}...")
     print("A PIN code should appear on your Shield TV screen.")
@@ -132,7 +244,7 @@ async def pair_with_shield(remote: AndroidTVRemote, host: str) -> str:
             pin = input("\nEnter PIN from Shield TV screen: ").strip().upper()
 
             # Validate PIN format - should be 6 hexadecimal characters
-            if len(pin) != 6 or not all(c in '0123456789ABCDEF' for c in pin):
+            if len(pin) != 6 or pin.translate(_NON_HEX):
                 print("Invalid PIN format. Please enter the 6-character hex PIN shown on screen (e.g., 4D292B).")
                 continue
 
@@ -141,10 +253,7 @@ async def pair_with_shield(remote: AndroidTVRemote, host: str) -> str:
                 print("Pairing successful!")
 
                 # Certificate is already persisted to certfile/keyfile by the library
-                # We return a marker to indicate successful pairing
-                cert_data = base64.b64encode(f"paired_{host}".encode()).decode()
-
-                return cert_data
+                return True
 
             except Exception as e:
                 error_msg = str(e).lower()
@@ -153,17 +262,17 @@ async def pair_with_shield(remote: AndroidTVRemote, host: str) -> str:
                     continue
                 elif "reject" in error_msg:
                     print("Error: Pairing rejected on TV. Please accept the pairing request.")
-                    return None
+                    return False
                 else:
                     print(f"Error during pairing: {e}")
-                    return None
+                    return False
 
     except Exception as e:
         print(f"Error: Cannot initiate pairing: {e}")
-        return None
+        return False
 
 
-async def connect_and_pair_if_needed(host: str, cert_data: str, force_repair: bool):
+async def connect_and_pair_if_needed(host: str, force_repair: bool):
     """Connect to Shield, pairing if needed.
 
     Certificate Persistence Strategy:
@@ -172,7 +281,9 @@ async def connect_and_pair_if_needed(host: str, cert_data: str, force_repair: bo
     certfile and keyfile parameters passed to AndroidTVRemote.__init__().
 
     How it works:
-    1. On first connection, we provide paths to temporary certificate files
+    1. We provide persistent paths next to this script:
+       - certfile: Path(__file__).parent / ".shield_cert.pem"
+       - keyfile: Path(__file__).parent / ".shield_key.pem"
     2. The library calls async_generate_cert_if_missing() which generates self-signed
        certificates and writes them to the specified certfile/keyfile paths
     3. During pairing (async_finish_pairing), the library authenticates the certificates
@@ -180,17 +291,10 @@ async def connect_and_pair_if_needed(host: str, cert_data: str, force_repair: bo
     4. For subsequent connections, the library loads the existing certificates from the
        file paths using ssl.SSLContext.load_cert_chain(certfile, keyfile)
 
-    Current Implementation:
-    -----------------------
-    We use temporary files that get deleted after each session. This means we re-pair
-    on every run, which is not ideal but functional.
-
-    Better approach would be to use persistent file paths like:
-    - certfile: Path(__file__).parent / ".shield_cert.pem"
-    - keyfile: Path(__file__).parent / ".shield_key.pem"
-
-    This would allow the library to reuse certificates across sessions without re-pairing.
-    The SHIELD_CERT in .env would then just serve as a marker that pairing completed.
+    Because the files persist, their presence is taken to mean pairing already
+    happened; no separate marker is kept in .env. The files can also outlive an
+    aborted pairing (they are written before the PIN prompt), so if the Shield
+    rejects them on connect we pair again and retry once.
 
     References:
     -----------
@@ -198,11 +302,14 @@ async def connect_and_pair_if_needed(host: str, cert_data: str, force_repair: bo
     - Home Assistant integration uses this pattern with persistent storage paths
     - Certificate format: PEM (Privacy Enhanced Mail) for both cert and private key
     """
+    from androidtvremote2 import AndroidTVRemote, InvalidAuth
+
     # Use persistent cert/key file paths to avoid re-pairing on every run
     cert_path = Path(__file__).parent / ".shield_cert.pem"
     key_path = Path(__file__).parent / ".shield_key.pem"
 
-    needs_pairing = force_repair or not cert_data
+    # The cert/key files are the real credential, so their presence means we paired
+    needs_pairing = force_repair or not (cert_path.is_file() and key_path.is_file())
 
     try:
         remote = AndroidTVRemote(
@@ -212,26 +319,42 @@ async def connect_and_pair_if_needed(host: str, cert_data: str, force_repair: bo
             host=host
         )
 
-        # Generate self-signed certificates - library will create the files
-        await remote.async_generate_cert_if_missing()
+        # Generate self-signed certificates - library will create the files.
+        # Skip the call when both exist so the happy path avoids the PEM checks.
+        if not (cert_path.is_file() and key_path.is_file()):
+            await remote.async_generate_cert_if_missing()
 
         if needs_pairing:
             # Pairing flow - start pairing before connecting
-            cert_data = await pair_with_shield(remote, host)
-            if cert_data:
-                save_config("SHIELD_CERT", cert_data)
-                print(f"Credentials saved to {ENV_FILE}")
-            else:
+            if not await pair_with_shield(remote, host):
                 print("Pairing failed.")
                 return None
 
         # Connect to Shield (after pairing if needed)
         print(f"Connecting to {host}:6466...")
-        await remote.async_connect()
+        try:
+            await asyncio.wait_for(remote.async_connect(), timeout=CONNECT_TIMEOUT)
+        except InvalidAuth:
+            if needs_pairing:
+                raise
+
+            # Certificate exists but isn't paired (e.g. an earlier pairing was aborted)
+            print("Shield did not accept the saved certificate, re-pairing...")
+            if not await pair_with_shield(remote, host):
+                print("Pairing failed.")
+                return None
+
+            print(f"Connecting to {host}:6466...")
+            await asyncio.wait_for(remote.async_connect(), timeout=CONNECT_TIMEOUT)
 
         return remote
 
-    except socket.timeout:
+    except InvalidAuth:
+        print(f"Error: Shield at {host} rejected the client certificate after pairing")
+        print("Run again with --repair to pair with the Shield.")
+        return None
+
+    except (socket.timeout, asyncio.TimeoutError):
         print(f"Error: Connection timeout")
         print(f"Is the Shield at {host} powered on?")
         return None
@@ -265,8 +388,10 @@ async def connect_and_pair_if_needed(host: str, cert_data: str, force_repair: bo
         return None
 
 
-async def send_play_pause(remote: AndroidTVRemote):
+async def send_play_pause(remote: "AndroidTVRemote"):
     """Send play/pause toggle command to Shield."""
+    from androidtvremote2.remote import RemoteKeyCode
+
     try:
         print("Sending play/pause command...")
         remote.send_key_command(RemoteKeyCode.KEYCODE_MEDIA_PLAY_PAUSE)
@@ -277,9 +402,9 @@ async def send_play_pause(remote: AndroidTVRemote):
         return False
 
 
-async def run_pause_command(host: str, cert_data: str, force_repair: bool):
+async def run_pause_command(host: str, force_repair: bool):
     """Main async function to connect and send pause command."""
-    remote = await connect_and_pair_if_needed(host, cert_data, force_repair)
+    remote = await connect_and_pair_if_needed(host, force_repair)
 
     if not remote:
         return False
@@ -293,10 +418,10 @@ async def run_pause_command(host: str, cert_data: str, force_repair: bool):
     return success
 
 
-async def main_async(host: str, cert: str, force_repair: bool):
+async def main_async(host: str, force_repair: bool):
     """Async main function to handle connection and cleanup."""
     # Run the pause command
-    success = await run_pause_command(host, cert, force_repair)
+    success = await run_pause_command(host, force_repair)
 
     return 0 if success else 1
 
@@ -308,11 +433,8 @@ def main():
 
     host = get_host_config(config, args)
 
-    # Clear cert if force repair
-    cert = None if args.repair else config["cert"]
-
     # Run async main with single event loop
-    return asyncio.run(main_async(host, cert, args.repair))
+    return asyncio.run(main_async(host, args.repair))
 
 
 if __name__ == "__main__":